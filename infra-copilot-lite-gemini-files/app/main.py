@@ -1,805 +1,1243 @@
-import os
-import json
-import time
-import random
-import logging
-import uuid
-from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
-
-import httpx
-import psutil
-from dotenv import load_dotenv
-
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-
-from azure.identity import DefaultAzureCredential
-
-# -------------------------
-# Load env + logging
-# -------------------------
-load_dotenv()
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO").upper(),
-    format="%(asctime)s | %(levelname)s | %(message)s",
-)
-logger = logging.getLogger("infracopilot-lite")
-
-# -------------------------
-# Config: Gemini
-# -------------------------
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "").strip()
-GEMINI_BASE = os.getenv("GEMINI_BASE", "https://generativelanguage.googleapis.com/v1beta").strip()
-
-# -------------------------
-# Config: Azure
-# -------------------------
-AZURE_SUBSCRIPTION_ID = os.getenv("AZURE_SUBSCRIPTION_ID", "").strip()
-AZURE_RESOURCE_GROUP = os.getenv("AZURE_RESOURCE_GROUP", "").strip()
-
-# -------------------------
-# Config: Custom endpoints checks
-# -------------------------
-CUSTOM_ENDPOINTS_RAW = os.getenv("CUSTOM_ENDPOINTS", "[]").strip()
-CUSTOM_ENDPOINT_TIMEOUT_SEC = float(os.getenv("CUSTOM_ENDPOINT_TIMEOUT_SEC", "5"))
-
-# -------------------------
-# Local thresholds
-# -------------------------
-LOCAL_CPU_WARN = float(os.getenv("LOCAL_CPU_WARN", "85"))
-LOCAL_MEM_WARN = float(os.getenv("LOCAL_MEM_WARN", "90"))
-LOCAL_DISK_WARN = float(os.getenv("LOCAL_DISK_WARN", "90"))
-
-# -------------------------
-# CORS
-# -------------------------
-ALLOWED_ORIGINS_RAW = os.getenv("ALLOWED_ORIGINS", "*").strip()
-if ALLOWED_ORIGINS_RAW == "*":
-    ALLOWED_ORIGINS = ["*"]
-else:
-    ALLOWED_ORIGINS = [o.strip() for o in ALLOWED_ORIGINS_RAW.split(",") if o.strip()]
-
-# -------------------------
-# Paths
-# -------------------------
-BASE_DIR = os.path.dirname(__file__)
-PUBLIC_DIR = os.path.join(BASE_DIR, "public")
-
-# -------------------------
-# FastAPI
-# -------------------------
-app = FastAPI(title="InfraCopilot Lite (Hybrid Health)", version="2.2.0")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-if os.path.isdir(PUBLIC_DIR):
-    app.mount("/static", StaticFiles(directory=PUBLIC_DIR), name="static")
-else:
-    logger.warning("public/ directory not found. UI static serving is disabled.")
-
-_AZ_CREDENTIAL: Optional[DefaultAzureCredential] = None
-
-
-# -------------------------
-# Session memory (in-memory)
-# -------------------------
-SESSION_TTL_MIN = int(os.getenv("SESSION_TTL_MIN", "60"))
-_SESSIONS: Dict[str, Dict[str, Any]] = {}
-
-
-def _purge_sessions():
-    now = datetime.now(timezone.utc)
-    dead = []
-    for sid, blob in _SESSIONS.items():
-        ts = blob.get("_ts")
-        if not ts:
-            dead.append(sid)
-            continue
-        if now - ts > timedelta(minutes=SESSION_TTL_MIN):
-            dead.append(sid)
-    for sid in dead:
-        _SESSIONS.pop(sid, None)
-
-
-def _get_session(session_id: str) -> Dict[str, Any]:
-    _purge_sessions()
-    if session_id not in _SESSIONS:
-        _SESSIONS[session_id] = {"_ts": datetime.now(timezone.utc), "history": []}
-    _SESSIONS[session_id]["_ts"] = datetime.now(timezone.utc)
-    return _SESSIONS[session_id]
-
-
-# -------------------------
-# Models
-# -------------------------
-class ReportRequest(BaseModel):
-    health: Optional[Dict[str, Any]] = None
-    metrics: Optional[Dict[str, Any]] = None
-
-
-class SupervisorRequest(BaseModel):
-    input: str = ""
-
-
-class ChatRequest(BaseModel):
-    input: str = ""
-    # "auto" lets Gemini decide; or force tool routing from ChatOps pills
-    mode: str = "auto"  # auto | health | metrics | report | daily_report
-    sessionId: Optional[str] = None
-
-
-# -------------------------
-# Helpers
-# -------------------------
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
-
-
-def _safe_json_loads(s: str, default):
-    try:
-        return json.loads(s)
-    except Exception:
-        return default
-
-
-def _normalize_gemini_model(model: str) -> str:
-    model = (model or "").strip()
-    if not model:
-        return ""
-    return model.replace("models/", "", 1) if model.startswith("models/") else model
-
-
-# -------------------------
-# UI routes
-# -------------------------
-@app.get("/")
-def ui_index():
-    if not os.path.isdir(PUBLIC_DIR):
-        return JSONResponse({"ok": False, "message": "UI not available. public/ folder missing."}, status_code=404)
-    return FileResponse(os.path.join(PUBLIC_DIR, "index.html"))
-
-
-@app.get("/healthz")
-def healthz():
-    return {"ok": True, "timestamp": _now_iso()}
-
-
-# -------------------------
-# Local health (REAL via psutil)
-# -------------------------
-def local_health() -> Dict[str, Any]:
-    warnings: List[str] = []
-
-    cpu = psutil.cpu_percent(interval=0.2)
-    mem = psutil.virtual_memory().percent
-
-    root_path = (os.getenv("SYSTEMDRIVE", "C:") + "\\") if os.name == "nt" else "/"
-    disk = psutil.disk_usage(root_path).percent
-
-    boot = datetime.fromtimestamp(psutil.boot_time(), tz=timezone.utc)
-    uptime_sec = int((datetime.now(timezone.utc) - boot).total_seconds())
-
-    if cpu >= LOCAL_CPU_WARN:
-        warnings.append(f"LOCAL: High CPU {cpu:.1f}% (>= {LOCAL_CPU_WARN}%)")
-    if mem >= LOCAL_MEM_WARN:
-        warnings.append(f"LOCAL: High Memory {mem:.1f}% (>= {LOCAL_MEM_WARN}%)")
-    if disk >= LOCAL_DISK_WARN:
-        warnings.append(f"LOCAL: High Disk {disk:.1f}% (>= {LOCAL_DISK_WARN}%)")
-
-    return {
-        "cpu_percent": round(cpu, 2),
-        "memory_percent": round(mem, 2),
-        "disk_percent": round(disk, 2),
-        "uptime_seconds": uptime_sec,
-        "warnings": warnings,
-    }
-
-
-# -------------------------
-# Azure health (optional)
-# -------------------------
-def _azure_get_credential() -> DefaultAzureCredential:
-    global _AZ_CREDENTIAL
-    if _AZ_CREDENTIAL is None:
-        _AZ_CREDENTIAL = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-    return _AZ_CREDENTIAL
-
-
-async def _azure_get_token() -> str:
-    cred = _azure_get_credential()
-    token = cred.get_token("https://management.azure.com/.default")
-    return token.token
-
-
-async def azure_health() -> Dict[str, Any]:
-    if not AZURE_SUBSCRIPTION_ID or not AZURE_RESOURCE_GROUP:
-        return {
-            "configured": False,
-            "status": "not_configured",
-            "message": "Set AZURE_SUBSCRIPTION_ID and AZURE_RESOURCE_GROUP to enable Azure checks.",
-            "vms": [],
-            "appServices": [],
-            "storageAccounts": [],
-            "warnings": [],
-        }
-
-    warnings: List[str] = []
-    try:
-        token = await _azure_get_token()
-    except Exception as e:
-        return {
-            "configured": True,
-            "status": "auth_failed",
-            "message": f"Azure auth failed: {e}",
-            "vms": [],
-            "appServices": [],
-            "storageAccounts": [],
-            "warnings": [f"AZURE: auth_failed - {e}"],
-        }
-
-    headers = {"Authorization": f"Bearer {token}"}
-    base = "https://management.azure.com"
-    sub = AZURE_SUBSCRIPTION_ID
-    rg = AZURE_RESOURCE_GROUP
-
-    vm_api = os.getenv("AZURE_VM_API_VERSION", "2024-03-01")
-    web_api = os.getenv("AZURE_WEB_API_VERSION", "2024-04-01")
-    st_api = os.getenv("AZURE_STORAGE_API_VERSION", "2023-01-01")
-
-    vms: List[Dict[str, Any]] = []
-    apps: List[Dict[str, Any]] = []
-    storages: List[Dict[str, Any]] = []
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        # VMs
-        try:
-            url = f"{base}/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.Compute/virtualMachines?api-version={vm_api}"
-            r = await client.get(url, headers=headers)
-            r.raise_for_status()
-            for item in r.json().get("value", []):
-                name = item.get("name")
-                vm_id = item.get("id")
-                state = "unknown"
-                iv_url = f"{base}{vm_id}/instanceView?api-version={vm_api}"
-                iv = await client.get(iv_url, headers=headers)
-                if iv.status_code == 200:
-                    statuses = iv.json().get("statuses") or []
-                    for s in statuses:
-                        code = s.get("code", "")
-                        if code.startswith("PowerState/"):
-                            state = code.split("/", 1)[1]
-                            break
-                vms.append({"name": name, "state": state})
-                if state not in ("running", "stopped", "deallocated"):
-                    warnings.append(f"AZURE: VM {name} state={state}")
-        except Exception as e:
-            warnings.append(f"AZURE: VM list failed - {e}")
-
-        # App Services
-        try:
-            url = f"{base}/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.Web/sites?api-version={web_api}"
-            r = await client.get(url, headers=headers)
-            r.raise_for_status()
-            for item in r.json().get("value", []):
-                name = item.get("name")
-                state = (item.get("properties") or {}).get("state", "unknown")
-                apps.append({"name": name, "state": state})
-                if state.lower() != "running":
-                    warnings.append(f"AZURE: AppService {name} state={state}")
-        except Exception as e:
-            warnings.append(f"AZURE: AppService list failed - {e}")
-
-        # Storage Accounts
-        try:
-            url = f"{base}/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.Storage/storageAccounts?api-version={st_api}"
-            r = await client.get(url, headers=headers)
-            r.raise_for_status()
-            for item in r.json().get("value", []):
-                name = item.get("name")
-                prov = (item.get("properties") or {}).get("provisioningState", "unknown")
-                storages.append({"name": name, "provisioningState": prov})
-                if prov.lower() != "succeeded":
-                    warnings.append(f"AZURE: Storage {name} provisioningState={prov}")
-        except Exception as e:
-            warnings.append(f"AZURE: Storage list failed - {e}")
-
-    status = "ok" if not warnings else "warnings"
-    return {
-        "configured": True,
-        "status": status,
-        "message": "Azure checks executed.",
-        "vms": vms,
-        "appServices": apps,
-        "storageAccounts": storages,
-        "warnings": warnings,
-    }
-
-
-# -------------------------
-# Custom endpoints checks
-# -------------------------
-async def custom_endpoints_health() -> Dict[str, Any]:
-    endpoints = _safe_json_loads(CUSTOM_ENDPOINTS_RAW, [])
-    results: List[Dict[str, Any]] = []
-    warnings: List[str] = []
-
-    if not isinstance(endpoints, list):
-        return {"configured": False, "results": [], "warnings": ["CUSTOM: CUSTOM_ENDPOINTS is not a JSON list"]}
-
-    async with httpx.AsyncClient(timeout=CUSTOM_ENDPOINT_TIMEOUT_SEC, follow_redirects=True) as client:
-        for ep in endpoints:
-            name = ep.get("name") if isinstance(ep, dict) else None
-            url = ep.get("url") if isinstance(ep, dict) else None
-            if not name or not url:
-                continue
-
-            start = time.perf_counter()
-            status = "DOWN"
-            http_status = None
-            err = None
-
-            try:
-                r = await client.get(url)
-                http_status = r.status_code
-                if 200 <= r.status_code < 400:
-                    status = "UP"
-                else:
-                    err = f"Bad status {r.status_code}"
-            except Exception as e:
-                err = str(e)
-
-            latency_ms = int((time.perf_counter() - start) * 1000)
-            results.append(
-                {
-                    "name": name,
-                    "url": url,
-                    "status": status,
-                    "http_status": http_status,
-                    "latency_ms": latency_ms,
-                    "error": err,
-                }
-            )
-            if status != "UP":
-                warnings.append(f"CUSTOM: {name} DOWN ({err})")
-
-    return {"configured": True, "results": results, "warnings": warnings}
-
-
-def aggregate_summary(local_warnings, azure_warnings, custom_warnings) -> Dict[str, Any]:
-    warnings: List[str] = []
-    warnings.extend(local_warnings or [])
-    warnings.extend(azure_warnings or [])
-    warnings.extend(custom_warnings or [])
-    total_checks = 3 + 1 + 1
-    return {
-        "total": total_checks,
-        "warnings": len(warnings),
-        "healthy": max(0, total_checks - len(warnings)),
-        "warnings_list": warnings,
-    }
-
-
-# =====================
-# API: healthcheck (REAL local health snapshot)
-# =====================
-@app.get("/api/healthcheck")
-async def api_healthcheck():
-    local = local_health()
-    azure = await azure_health()
-    custom = await custom_endpoints_health()
-
-    summary = aggregate_summary(
-        local_warnings=local.get("warnings"),
-        azure_warnings=azure.get("warnings"),
-        custom_warnings=custom.get("warnings"),
-    )
-
-    return {
-        "ok": True,
-        "data": {
-            "timestamp": _now_iso(),
-            "summary": {
-                "total": summary["total"],
-                "healthy": summary["healthy"],
-                "warnings": summary["warnings"],
-            },
-            "warnings": summary["warnings_list"],
-            "local": local,
-            "azure": azure,
-            "custom": custom,
-        },
-    }
-
-
-# =====================
-# API: metrics (24h trend is synthetic, base uses live cpu/mem)
-# =====================
-@app.get("/api/metrics")
-def api_metrics():
-    base_cpu = psutil.cpu_percent(interval=0.1)
-    base_mem = psutil.virtual_memory().percent
-
-    def series(points=24, base=50, jitter=10):
-        out = []
-        now = datetime.now(timezone.utc)
-        for i in range(points):
-            t = now - timedelta(hours=(points - 1 - i))
-            v = max(0, min(100, base + (random.random() - 0.5) * jitter))
-            out.append({"t": t.isoformat(), "v": round(v, 2)})
-        return out
-
-    return {
-        "ok": True,
-        "data": {
-            "timestamp": _now_iso(),
-            "range": "24h",
-            "syntheticTrend": True,
-            "cpu": series(base=base_cpu, jitter=18),
-            "memory": series(base=base_mem, jitter=14),
-            "disk": series(base=55, jitter=10),
-            "netio": series(base=35, jitter=22),
-        },
-    }
-
-
-# =====================
-# API: model listing
-# =====================
-@app.get("/api/models")
-async def api_models():
-    if not GEMINI_API_KEY:
-        raise HTTPException(status_code=500, detail="GEMINI_API_KEY missing. Set it in .env")
-
-    url = f"{GEMINI_BASE}/models"
-    headers = {"x-goog-api-key": GEMINI_API_KEY}
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.get(url, headers=headers)
-        data = r.json()
-        if r.status_code >= 400:
-            msg = (data.get("error") or {}).get("message") or "Failed to list models"
-            raise HTTPException(status_code=500, detail=msg)
-
-    models = []
-    for m in data.get("models", []):
-        name = m.get("name")
-        methods = m.get("supportedGenerationMethods") or []
-        models.append(
-            {
-                "name": name,
-                "supports_generateContent": "generateContent" in methods,
-                "supportedGenerationMethods": methods,
-            }
-        )
-    return {"ok": True, "models": models}
-
-
-# -------------------------
-# Gemini call
-# -------------------------
-async def gemini_generate(system_instruction: str, user_text: str, history=None, temperature=0.4, max_tokens=900) -> str:
-    if not GEMINI_API_KEY:
-        raise HTTPException(status_code=500, detail="GEMINI_API_KEY missing. Set it in .env")
-    if not GEMINI_MODEL:
-        raise HTTPException(status_code=500, detail="GEMINI_MODEL missing. Set it in .env (use /api/models).")
-
-    model = _normalize_gemini_model(GEMINI_MODEL)
-    url = f"{GEMINI_BASE}/models/{model}:generateContent"
-
-    history = history or []
-    payload = {
-        "contents": [*history, {"role": "user", "parts": [{"text": user_text}]}],
-        "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens},
-    }
-    if system_instruction:
-        payload["systemInstruction"] = {"role": "system", "parts": [{"text": system_instruction}]}
-
-    headers = {"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY}
-
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        data = resp.json()
-
-    if resp.status_code >= 400:
-        msg = (data.get("error") or {}).get("message") or "Gemini API error"
-        raise HTTPException(status_code=500, detail=msg)
-
-    parts = (((data.get("candidates") or [{}])[0].get("content") or {}).get("parts") or [])
-    text = "".join([p.get("text", "") for p in parts if isinstance(p, dict)])
-    return text.strip()
-
-
-# =====================
-# API: report (Gemini summarization)
-# =====================
-@app.post("/api/report")
-async def api_report(req: ReportRequest):
-    health = req.health
-    metrics = req.metrics
-
-    if not health:
-        health_resp = await api_healthcheck()
-        health = health_resp["data"]
-
-    if not metrics:
-        metrics = api_metrics()["data"]
-
-    system_instruction = (
-        "You are InfraCopilot Lite, a virtual SRE assistant. "
-        "Summarize infra health + metrics in plain English. "
-        "Highlight risks and suggest NON-DESTRUCTIVE next actions only. "
-        "Format output as Markdown with headings, bullet points, and a short 'Next Actions' section."
-    )
-
-    user_text = f"""Generate today's hybrid infra health report.
-LOCAL HEALTH:
-{json.dumps(health.get('local', {}), indent=2)}
-
-AZURE HEALTH:
-{json.dumps(health.get('azure', {}), indent=2)}
-
-CUSTOM ENDPOINTS:
-{json.dumps(health.get('custom', {}), indent=2)}
-
-METRICS:
-{json.dumps(metrics, indent=2)}
-
-Be concise, actionable, and include a short risk score (Low/Med/High).
-"""
-
-    md = await gemini_generate(system_instruction, user_text)
-    return {"ok": True, "reportMarkdown": md, "usedModel": GEMINI_MODEL}
-
-
-# =====================
-# Legacy supervisor endpoint (keep for compatibility)
-# =====================
-@app.post("/api/supervisor")
-async def api_supervisor(payload: SupervisorRequest):
-    # Keep minimal: treat as pure chat now
-    system_instruction = (
-        "You are InfraCopilot Lite, a ChatOps SRE assistant for Azure-like environments. "
-        "Answer clearly. If a user asks for destructive actions, suggest safe read-only alternatives."
-    )
-    text = await gemini_generate(system_instruction, payload.input or "")
-    return {"ok": True, "intent": "chat", "text": text, "usedModel": GEMINI_MODEL}
-
-
-# =====================
-# Agentic Chat: /api/chat
-# Gemini decides tool usage, backend executes, Gemini answers using tool output.
-# =====================
-def _extract_json_object(s: str) -> Optional[dict]:
-    s = (s or "").strip()
-    if not s:
-        return None
-    try:
-        return json.loads(s)
-    except Exception:
-        pass
-
-    # try to extract first {...}
-    start = s.find("{")
-    end = s.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        chunk = s[start : end + 1]
-        try:
-            return json.loads(chunk)
-        except Exception:
-            return None
-    return None
-
-
-async def _plan_action_with_gemini(user_text: str, session: Dict[str, Any], mode: str) -> Dict[str, Any]:
-    """
-    Returns: {"action": "...", "why": "...", "need_tools": bool}
-    """
-    # Mode override (from ChatOps pills)
-    mode = (mode or "auto").lower().strip()
-    if mode in ("health", "metrics", "report", "daily_report"):
-        return {"action": mode, "why": f"forced_by_mode:{mode}", "need_tools": True}
-
-    # Build a small context summary for Gemini
-    ctx = {
-        "has_last_health": bool(session.get("last_health")),
-        "has_last_metrics": bool(session.get("last_metrics")),
-        "has_last_report": bool(session.get("last_report")),
-    }
-
-    system = (
-        "You are an SRE ChatOps router. Decide the best action for the user.\n"
-        "Return ONLY a JSON object with keys:\n"
-        "  action: one of [chat, health, metrics, report, daily_report]\n"
-        "  why: short reason\n"
-        "  need_tools: true/false\n"
-        "Routing rules:\n"
-        "- If user asks to run/check health/status/uptime/warnings/local system => action=health\n"
-        "- If user asks charts/trends/last 24h/metrics => action=metrics\n"
-        "- If user asks report/summary => action=report\n"
-        "- If user asks daily report => action=daily_report\n"
-        "- If user asks follow-up like 'give details' and ctx has last_health => action=health\n"
-        "- Otherwise action=chat\n"
-        "Output must be valid JSON only."
-    )
-
-    user = f"""User message: {user_text}
-Context flags: {json.dumps(ctx)}
-"""
-
-    plan_raw = await gemini_generate(system, user, temperature=0.0, max_tokens=220)
-    plan = _extract_json_object(plan_raw) or {}
-
-    action = (plan.get("action") or "chat").strip().lower()
-    if action not in ("chat", "health", "metrics", "report", "daily_report"):
-        action = "chat"
-
-    need_tools = bool(plan.get("need_tools")) if "need_tools" in plan else (action != "chat")
-    why = (plan.get("why") or "n/a").strip()
-
-    return {"action": action, "why": why, "need_tools": need_tools}
-
-
-async def _answer_with_tools(user_text: str, action: str, session: Dict[str, Any], tool_payload: Dict[str, Any]) -> str:
-    """
-    Gemini final response using tool outputs.
-    """
-    system = (
-        "You are InfraCopilot Lite, an SRE assistant.\n"
-        "Use TOOL_OUTPUTS to answer the user's question.\n"
-        "Be concise but helpful. Include:\n"
-        "- what you observed\n"
-        "- key values (cpu/mem/disk/uptime for health)\n"
-        "- warnings if any\n"
-        "- non-destructive next steps\n"
-        "Format with short headings and bullets.\n"
-        "Do NOT ask unnecessary clarification if TOOL_OUTPUTS already contains the needed info."
-    )
-
-    user = f"""USER_QUESTION:
-{user_text}
-
-ACTION:
-{action}
-
-TOOL_OUTPUTS (JSON):
-{json.dumps(tool_payload, indent=2)[:12000]}
-"""
-
-    return await gemini_generate(system, user, temperature=0.35, max_tokens=900)
-
-
-@app.post("/api/chat")
-async def api_chat(req: ChatRequest):
-    session_id = req.sessionId or str(uuid.uuid4())
-    session = _get_session(session_id)
-
-    user_text = (req.input or "").strip()
-    if not user_text:
-        return {"ok": True, "sessionId": session_id, "toolUsed": "none", "text": "Say something and I’ll help."}
-
-    # Keep simple conversation history for better follow-ups
-    history = session.get("history") or []
-
-# ---- Append current user message to session history (Gemini format) ----
-    history.append({"role": "user", "parts": [{"text": user_text}]})
-
-    # Keep history bounded (avoid huge payloads)
-    max_turns = int(os.getenv("CHAT_HISTORY_TURNS", "10"))
-    if len(history) > max_turns * 2:  # user+bot pairs
-        history = history[-max_turns * 2 :]
-
-    session["history"] = history
-
-    # ---- Plan: let Gemini (or forced mode) decide action/tool usage ----
-    plan = await _plan_action_with_gemini(user_text, session, req.mode)
-    action = plan.get("action", "chat")
-    why = plan.get("why", "")
-    need_tools = bool(plan.get("need_tools", action != "chat"))
-
-    tool_payload: Dict[str, Any] = {"action": action, "why": why}
-    tool_used = action
-
-    # ---- Execute tools if needed ----
-    health_obj = None
-    metrics_obj = None
-    report_md = None
-
-    try:
-        if need_tools and action in ("health", "daily_report", "report"):
-            hc = await api_healthcheck()
-            health_obj = hc["data"]
-            session["last_health"] = health_obj
-            tool_payload["health"] = health_obj
-
-        if need_tools and action in ("metrics", "daily_report", "report"):
-            mc = api_metrics()
-            metrics_obj = mc["data"]
-            session["last_metrics"] = metrics_obj
-            tool_payload["metrics"] = metrics_obj
-
-        if need_tools and action in ("report", "daily_report"):
-            # Use tool outputs if already fetched, else pull from session
-            h = health_obj or session.get("last_health")
-            m = metrics_obj or session.get("last_metrics")
-
-            rep = await api_report(ReportRequest(health=h, metrics=m))
-            report_md = rep.get("reportMarkdown", "")
-            session["last_report"] = report_md
-            tool_payload["reportMarkdown"] = report_md
-
-    except HTTPException:
-        # bubble up FastAPI errors (e.g., missing GEMINI key/model)
-        raise
-    except Exception as e:
-        logger.exception("Tool execution failed")
-        raise HTTPException(status_code=500, detail=f"Tool execution failed: {e}")
-
-    # ---- Final answer: Gemini composes response using tool outputs (agentic) ----
-    try:
-        if action == "chat":
-            system = (
-                "You are InfraCopilot Lite, a helpful SRE assistant.\n"
-                "Answer clearly and practically.\n"
-                "If the user asks for destructive actions, suggest safe read-only alternatives.\n"
-                "Use brief headings and bullet points when helpful."
-            )
-            final_text = await gemini_generate(system, user_text, history=history, temperature=0.45, max_tokens=900)
-        else:
-            # If user asks follow-up like “details”, use last tool outputs even if tool didn't run
-            if action == "health" and not health_obj:
-                health_obj = session.get("last_health")
-                if health_obj:
-                    tool_payload["health"] = health_obj
-
-            if action == "metrics" and not metrics_obj:
-                metrics_obj = session.get("last_metrics")
-                if metrics_obj:
-                    tool_payload["metrics"] = metrics_obj
-
-            if action in ("report", "daily_report") and not report_md:
-                report_md = session.get("last_report")
-                if report_md:
-                    tool_payload["reportMarkdown"] = report_md
-
-            final_text = await _answer_with_tools(user_text, action, session, tool_payload)
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.exception("Gemini answer generation failed")
-        raise HTTPException(status_code=500, detail=f"Gemini answer generation failed: {e}")
-
-    # ---- Add assistant message into history ----
-    history.append({"role": "model", "parts": [{"text": final_text}]})
-    if len(history) > max_turns * 2:
-        history = history[-max_turns * 2 :]
-    session["history"] = history
-
-    # ---- Build response expected by updated app.js ----
-    resp: Dict[str, Any] = {
-        "ok": True,
-        "sessionId": session_id,
-        "toolUsed": tool_used,
-        "text": final_text,
-        "usedModel": GEMINI_MODEL,
-    }
-
-    # Attach tool results so UI can update dashboard (KPIs/charts/report)
-    if health_obj:
-        resp["health"] = health_obj
-    if metrics_obj:
-        resp["metrics"] = metrics_obj
-    if report_md is not None:
-        resp["reportMarkdown"] = report_md
-
-    return resp
\ No newline at end of file
+import asyncio
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import orjson
+import psutil
+from dotenv import load_dotenv
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
+
+from azure.identity import DefaultAzureCredential
+
+# -------------------------
+# Load env + logging
+# -------------------------
+load_dotenv()
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s | %(levelname)s | %(message)s",
+)
+logger = logging.getLogger("infracopilot-lite")
+
+# -------------------------
+# Config: Gemini
+# -------------------------
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "").strip()
+GEMINI_BASE = os.getenv("GEMINI_BASE", "https://generativelanguage.googleapis.com/v1beta").strip()
+
+# -------------------------
+# Config: Azure
+# -------------------------
+AZURE_SUBSCRIPTION_ID = os.getenv("AZURE_SUBSCRIPTION_ID", "").strip()
+AZURE_RESOURCE_GROUP = os.getenv("AZURE_RESOURCE_GROUP", "").strip()
+
+# -------------------------
+# Config: Custom endpoints checks
+# -------------------------
+CUSTOM_ENDPOINTS_RAW = os.getenv("CUSTOM_ENDPOINTS", "[]").strip()
+CUSTOM_ENDPOINT_TIMEOUT_SEC = float(os.getenv("CUSTOM_ENDPOINT_TIMEOUT_SEC", "5"))
+
+# -------------------------
+# Local thresholds
+# -------------------------
+LOCAL_CPU_WARN = float(os.getenv("LOCAL_CPU_WARN", "85"))
+LOCAL_MEM_WARN = float(os.getenv("LOCAL_MEM_WARN", "90"))
+LOCAL_DISK_WARN = float(os.getenv("LOCAL_DISK_WARN", "90"))
+
+# psutil.cpu_percent(interval=None) measures since the previous call, so two
+# calls back-to-back return garbage. Reuse the last sample within this window.
+CPU_SAMPLE_MIN_INTERVAL_SEC = float(os.getenv("CPU_SAMPLE_MIN_INTERVAL_SEC", "0.5"))
+
+# Short TTL shared by the health snapshot caches, so bursts of chat/dashboard
+# requests reuse one psutil sweep and one set of Azure/custom round trips.
+HEALTH_CACHE_TTL_SEC = float(os.getenv("HEALTH_CACHE_TTL_SEC", "3"))
+
+# -------------------------
+# CORS
+# -------------------------
+ALLOWED_ORIGINS_RAW = os.getenv("ALLOWED_ORIGINS", "*").strip()
+if ALLOWED_ORIGINS_RAW == "*":
+    ALLOWED_ORIGINS = ["*"]
+else:
+    ALLOWED_ORIGINS = [o.strip() for o in ALLOWED_ORIGINS_RAW.split(",") if o.strip()]
+
+# -------------------------
+# Paths
+# -------------------------
+BASE_DIR = os.path.dirname(__file__)
+PUBLIC_DIR = os.path.join(BASE_DIR, "public")
+
+# -------------------------
+# FastAPI
+# -------------------------
+app = FastAPI(
+    title="InfraCopilot Lite (Hybrid Health)",
+    version="2.2.0",
+)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+if os.path.isdir(PUBLIC_DIR):
+    app.mount("/static", StaticFiles(directory=PUBLIC_DIR), name="static")
+else:
+    logger.warning("public/ directory not found. UI static serving is disabled.")
+
+_AZ_CREDENTIAL: Optional[DefaultAzureCredential] = None
+
+
+@app.on_event("startup")
+async def _prime_cpu_percent():
+    # Prime the interval=None baseline so the first request-path sample is
+    # meaningful. All later samples are non-blocking (no interval sleep).
+    psutil.cpu_percent(interval=None)
+
+
+@app.on_event("startup")
+async def _create_http_clients():
+    # One long-lived client per upstream so TCP+TLS sessions are reused
+    # across requests instead of re-handshaking on every call.
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+    app.state.azure_client = httpx.AsyncClient(timeout=30, limits=limits)
+    # HTTP/2 lets concurrent plan+answer Gemini calls multiplex one connection.
+    app.state.gemini_client = httpx.AsyncClient(timeout=60, http2=True, limits=limits)
+    app.state.custom_client = httpx.AsyncClient(
+        timeout=CUSTOM_ENDPOINT_TIMEOUT_SEC, follow_redirects=True, limits=limits
+    )
+
+
+@app.on_event("shutdown")
+async def _close_http_clients():
+    for client in (app.state.azure_client, app.state.gemini_client, app.state.custom_client):
+        await client.aclose()
+
+
+# -------------------------
+# Session memory (in-memory)
+# -------------------------
+SESSION_TTL_MIN = int(os.getenv("SESSION_TTL_MIN", "60"))
+# sessionId is caller-chosen, so cap the store and evict least-recently-used
+# entries; TTL purging alone can't stop a client minting unlimited ids.
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+_SESSIONS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# Min-heap of (expiry_ts, session_id). A session refresh pushes a new entry
+# instead of updating the old one; stale entries are discarded lazily when
+# they surface at the head, so purging stays O(expired * log N), not O(N).
+_SESSION_EXPIRY: List[Tuple[float, str]] = []
+
+
+def _purge_sessions():
+    now = time.monotonic()
+    while _SESSION_EXPIRY and _SESSION_EXPIRY[0][0] <= now:
+        exp, sid = heapq.heappop(_SESSION_EXPIRY)
+        blob = _SESSIONS.get(sid)
+        if blob is not None and blob.get("_exp") == exp:
+            _SESSIONS.pop(sid, None)
+
+
+def _get_session(session_id: str) -> Dict[str, Any]:
+    _purge_sessions()
+    if session_id in _SESSIONS:
+        _SESSIONS.move_to_end(session_id)
+    else:
+        while len(_SESSIONS) >= MAX_SESSIONS:
+            _SESSIONS.popitem(last=False)
+        _SESSIONS[session_id] = {"history": []}
+    blob = _SESSIONS[session_id]
+    exp = time.monotonic() + SESSION_TTL_MIN * 60
+    blob["_exp"] = exp
+    heapq.heappush(_SESSION_EXPIRY, (exp, session_id))
+    return blob
+
+
+# -------------------------
+# Models
+# -------------------------
+class ReportRequest(BaseModel):
+    health: Optional[Dict[str, Any]] = None
+    metrics: Optional[Dict[str, Any]] = None
+
+
+class SupervisorRequest(BaseModel):
+    input: str = ""
+
+
+class ChatRequest(BaseModel):
+    input: str = ""
+    # "auto" lets Gemini decide; or force tool routing from ChatOps pills
+    mode: str = "auto"  # auto | health | metrics | report | daily_report
+    sessionId: Optional[str] = None
+    # Opt-in SSE streaming for plain chat answers (JSON response otherwise)
+    stream: bool = False
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _safe_json_loads(s: str, default):
+    try:
+        return orjson.loads(s)
+    except Exception:
+        return default
+
+
+def _dumps_pretty(obj: Any) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+
+def _normalize_gemini_model(model: str) -> str:
+    model = (model or "").strip()
+    if not model:
+        return ""
+    return model.replace("models/", "", 1) if model.startswith("models/") else model
+
+
+# Process-constants for the Gemini request path; model/base/key never change
+# after env parsing, so don't rebuild these strings on every call.
+_GEMINI_MODEL_NORM = _normalize_gemini_model(GEMINI_MODEL)
+_GEMINI_GENERATE_URL = f"{GEMINI_BASE}/models/{_GEMINI_MODEL_NORM}:generateContent" if _GEMINI_MODEL_NORM else ""
+_GEMINI_STREAM_URL = (
+    f"{GEMINI_BASE}/models/{_GEMINI_MODEL_NORM}:streamGenerateContent?alt=sse" if _GEMINI_MODEL_NORM else ""
+)
+_GEMINI_HEADERS = {"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY}
+
+
+# -------------------------
+# UI routes
+# -------------------------
+@app.get("/")
+def ui_index():
+    if not os.path.isdir(PUBLIC_DIR):
+        return JSONResponse({"ok": False, "message": "UI not available. public/ folder missing."}, status_code=404)
+    return FileResponse(os.path.join(PUBLIC_DIR, "index.html"))
+
+
+@app.get("/healthz")
+def healthz():
+    return {"ok": True, "timestamp": _now_iso()}
+
+
+# -------------------------
+# Local health (REAL via psutil)
+# -------------------------
+# Disk root and boot time are process-constants; resolve them once instead
+# of re-reading the environment and epoch on every health call.
+_ROOT_PATH = (os.getenv("SYSTEMDRIVE", "C:") + os.sep) if os.name == "nt" else "/"
+_BOOT_TS = psutil.boot_time()
+
+_CPU_SAMPLE: Dict[str, float] = {"value": 0.0, "ts": 0.0}
+
+
+def _cpu_percent() -> float:
+    now = time.monotonic()
+    if now - _CPU_SAMPLE["ts"] < CPU_SAMPLE_MIN_INTERVAL_SEC:
+        return _CPU_SAMPLE["value"]
+    _CPU_SAMPLE["value"] = psutil.cpu_percent(interval=None)
+    _CPU_SAMPLE["ts"] = now
+    return _CPU_SAMPLE["value"]
+
+
+_LOCAL_HEALTH_CACHE: Dict[str, Any] = {"value": None, "ts": 0.0}
+
+
+def local_health() -> Dict[str, Any]:
+    now = time.monotonic()
+    if _LOCAL_HEALTH_CACHE["value"] is not None and now - _LOCAL_HEALTH_CACHE["ts"] < HEALTH_CACHE_TTL_SEC:
+        return _LOCAL_HEALTH_CACHE["value"]
+
+    warnings: List[str] = []
+
+    cpu = _cpu_percent()
+    mem = psutil.virtual_memory().percent
+
+    disk = psutil.disk_usage(_ROOT_PATH).percent
+
+    uptime_sec = int(time.time() - _BOOT_TS)
+
+    if cpu >= LOCAL_CPU_WARN:
+        warnings.append(f"LOCAL: High CPU {cpu:.1f}% (>= {LOCAL_CPU_WARN}%)")
+    if mem >= LOCAL_MEM_WARN:
+        warnings.append(f"LOCAL: High Memory {mem:.1f}% (>= {LOCAL_MEM_WARN}%)")
+    if disk >= LOCAL_DISK_WARN:
+        warnings.append(f"LOCAL: High Disk {disk:.1f}% (>= {LOCAL_DISK_WARN}%)")
+
+    result = {
+        "cpu_percent": round(cpu, 2),
+        "memory_percent": round(mem, 2),
+        "disk_percent": round(disk, 2),
+        "uptime_seconds": uptime_sec,
+        "warnings": warnings,
+    }
+    _LOCAL_HEALTH_CACHE["value"] = result
+    _LOCAL_HEALTH_CACHE["ts"] = time.monotonic()
+    return result
+
+
+# -------------------------
+# Azure health (optional)
+# -------------------------
+def _azure_get_credential() -> DefaultAzureCredential:
+    global _AZ_CREDENTIAL
+    if _AZ_CREDENTIAL is None:
+        _AZ_CREDENTIAL = DefaultAzureCredential(exclude_interactive_browser_credential=False)
+    return _AZ_CREDENTIAL
+
+
+# Tokens are valid for about an hour; refresh this long before expires_on so
+# in-flight requests never hold a token that lapses mid-call.
+_AZ_TOKEN_REFRESH_SKEW_SEC = 300
+_AZ_TOKEN_CACHE: Dict[str, Any] = {"token": None, "exp": 0.0, "lock": asyncio.Lock()}
+
+
+async def _azure_get_token() -> str:
+    now = time.time()
+    if _AZ_TOKEN_CACHE["token"] and now < _AZ_TOKEN_CACHE["exp"] - _AZ_TOKEN_REFRESH_SKEW_SEC:
+        return _AZ_TOKEN_CACHE["token"]
+    # Single-flight: concurrent health checks share one token acquisition.
+    async with _AZ_TOKEN_CACHE["lock"]:
+        now = time.time()
+        if _AZ_TOKEN_CACHE["token"] and now < _AZ_TOKEN_CACHE["exp"] - _AZ_TOKEN_REFRESH_SKEW_SEC:
+            return _AZ_TOKEN_CACHE["token"]
+        # Credential construction and get_token are synchronous and can probe
+        # MSI endpoints or shell out to the az CLI; keep them off the loop.
+        cred = await asyncio.to_thread(_azure_get_credential)
+        token = await asyncio.to_thread(cred.get_token, "https://management.azure.com/.default")
+        _AZ_TOKEN_CACHE["token"] = token.token
+        _AZ_TOKEN_CACHE["exp"] = float(token.expires_on)
+        return token.token
+
+
+_AZURE_HEALTH_CACHE: Dict[str, Any] = {"value": None, "ts": 0.0, "lock": asyncio.Lock()}
+
+
+async def azure_health() -> Dict[str, Any]:
+    return await _cached_refresh(_AZURE_HEALTH_CACHE, _azure_health_uncached)
+
+
+async def _cached_refresh(cache: Dict[str, Any], refresh) -> Dict[str, Any]:
+    now = time.monotonic()
+    if cache["value"] is not None and now - cache["ts"] < HEALTH_CACHE_TTL_SEC:
+        return cache["value"]
+    # Single-flight: one coroutine refreshes, concurrent callers wait on the
+    # lock and pick up the fresh value on the re-check.
+    async with cache["lock"]:
+        now = time.monotonic()
+        if cache["value"] is not None and now - cache["ts"] < HEALTH_CACHE_TTL_SEC:
+            return cache["value"]
+        value = await refresh()
+        cache["value"] = value
+        cache["ts"] = time.monotonic()
+        return value
+
+
+async def _azure_health_uncached() -> Dict[str, Any]:
+    if not AZURE_SUBSCRIPTION_ID or not AZURE_RESOURCE_GROUP:
+        return {
+            "configured": False,
+            "status": "not_configured",
+            "message": "Set AZURE_SUBSCRIPTION_ID and AZURE_RESOURCE_GROUP to enable Azure checks.",
+            "vms": [],
+            "appServices": [],
+            "storageAccounts": [],
+            "warnings": [],
+        }
+
+    warnings: List[str] = []
+    try:
+        token = await _azure_get_token()
+    except Exception as e:
+        return {
+            "configured": True,
+            "status": "auth_failed",
+            "message": f"Azure auth failed: {e}",
+            "vms": [],
+            "appServices": [],
+            "storageAccounts": [],
+            "warnings": [f"AZURE: auth_failed - {e}"],
+        }
+
+    headers = {"Authorization": f"Bearer {token}"}
+    base = "https://management.azure.com"
+    sub = AZURE_SUBSCRIPTION_ID
+    rg = AZURE_RESOURCE_GROUP
+
+    vm_api = os.getenv("AZURE_VM_API_VERSION", "2024-03-01")
+    web_api = os.getenv("AZURE_WEB_API_VERSION", "2024-04-01")
+    st_api = os.getenv("AZURE_STORAGE_API_VERSION", "2023-01-01")
+
+    vms: List[Dict[str, Any]] = []
+    apps: List[Dict[str, Any]] = []
+    storages: List[Dict[str, Any]] = []
+
+    client = app.state.azure_client
+
+    # Bound the fan-out so big resource groups don't trip ARM throttling.
+    sem = asyncio.Semaphore(int(os.getenv("AZURE_MAX_CONCURRENCY", "10")))
+
+    async def _get(url: str) -> httpx.Response:
+        async with sem:
+            return await client.get(url, headers=headers)
+
+    vm_url = f"{base}/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.Compute/virtualMachines?api-version={vm_api}"
+    web_url = f"{base}/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.Web/sites?api-version={web_api}"
+    st_url = f"{base}/subscriptions/{sub}/resourceGroups/{rg}/providers/Microsoft.Storage/storageAccounts?api-version={st_api}"
+
+    # The three ARM list calls are independent; issue them in parallel.
+    vm_resp, web_resp, st_resp = await asyncio.gather(
+        _get(vm_url), _get(web_url), _get(st_url), return_exceptions=True
+    )
+
+    # VMs
+    try:
+        if isinstance(vm_resp, BaseException):
+            raise vm_resp
+        vm_resp.raise_for_status()
+        items = vm_resp.json().get("value", [])
+        ivs = await asyncio.gather(
+            *(_get(f"{base}{item.get('id')}/instanceView?api-version={vm_api}") for item in items),
+            return_exceptions=True,
+        )
+        for item, iv in zip(items, ivs):
+            name = item.get("name")
+            state = "unknown"
+            if not isinstance(iv, BaseException) and iv.status_code == 200:
+                statuses = iv.json().get("statuses") or []
+                for s in statuses:
+                    code = s.get("code", "")
+                    if code.startswith("PowerState/"):
+                        state = code.split("/", 1)[1]
+                        break
+            vms.append({"name": name, "state": state})
+            if state not in ("running", "stopped", "deallocated"):
+                warnings.append(f"AZURE: VM {name} state={state}")
+    except Exception as e:
+        warnings.append(f"AZURE: VM list failed - {e}")
+
+    # App Services
+    try:
+        if isinstance(web_resp, BaseException):
+            raise web_resp
+        web_resp.raise_for_status()
+        for item in web_resp.json().get("value", []):
+            name = item.get("name")
+            state = (item.get("properties") or {}).get("state", "unknown")
+            apps.append({"name": name, "state": state})
+            if state.lower() != "running":
+                warnings.append(f"AZURE: AppService {name} state={state}")
+    except Exception as e:
+        warnings.append(f"AZURE: AppService list failed - {e}")
+
+    # Storage Accounts
+    try:
+        if isinstance(st_resp, BaseException):
+            raise st_resp
+        st_resp.raise_for_status()
+        for item in st_resp.json().get("value", []):
+            name = item.get("name")
+            prov = (item.get("properties") or {}).get("provisioningState", "unknown")
+            storages.append({"name": name, "provisioningState": prov})
+            if prov.lower() != "succeeded":
+                warnings.append(f"AZURE: Storage {name} provisioningState={prov}")
+    except Exception as e:
+        warnings.append(f"AZURE: Storage list failed - {e}")
+
+    status = "ok" if not warnings else "warnings"
+    return {
+        "configured": True,
+        "status": status,
+        "message": "Azure checks executed.",
+        "vms": vms,
+        "appServices": apps,
+        "storageAccounts": storages,
+        "warnings": warnings,
+    }
+
+
+# -------------------------
+# Custom endpoints checks
+# -------------------------
+_CUSTOM_HEALTH_CACHE: Dict[str, Any] = {"value": None, "ts": 0.0, "lock": asyncio.Lock()}
+
+
+async def custom_endpoints_health() -> Dict[str, Any]:
+    return await _cached_refresh(_CUSTOM_HEALTH_CACHE, _custom_endpoints_health_uncached)
+
+
+async def _probe_endpoint(name: str, url: str, client: httpx.AsyncClient, sem: asyncio.Semaphore) -> Dict[str, Any]:
+    async with sem:
+        start = time.perf_counter()
+        status = "DOWN"
+        http_status = None
+        err = None
+
+        try:
+            r = await client.get(url)
+            http_status = r.status_code
+            if 200 <= r.status_code < 400:
+                status = "UP"
+            else:
+                err = f"Bad status {r.status_code}"
+        except Exception as e:
+            err = str(e)
+
+        latency_ms = int((time.perf_counter() - start) * 1000)
+        return {
+            "name": name,
+            "url": url,
+            "status": status,
+            "http_status": http_status,
+            "latency_ms": latency_ms,
+            "error": err,
+        }
+
+
+async def _custom_endpoints_health_uncached() -> Dict[str, Any]:
+    endpoints = _safe_json_loads(CUSTOM_ENDPOINTS_RAW, [])
+    warnings: List[str] = []
+
+    if not isinstance(endpoints, list):
+        return {"configured": False, "results": [], "warnings": ["CUSTOM: CUSTOM_ENDPOINTS is not a JSON list"]}
+
+    valid = [
+        (ep["name"], ep["url"])
+        for ep in endpoints
+        if isinstance(ep, dict) and ep.get("name") and ep.get("url")
+    ]
+
+    # Probe all endpoints concurrently; total latency is the slowest probe,
+    # not the sum of all of them.
+    client = app.state.custom_client
+    sem = asyncio.Semaphore(int(os.getenv("CUSTOM_MAX_CONCURRENCY", "32")))
+    results = list(await asyncio.gather(*(_probe_endpoint(name, url, client, sem) for name, url in valid)))
+
+    for res in results:
+        if res["status"] != "UP":
+            warnings.append(f"CUSTOM: {res['name']} DOWN ({res['error']})")
+
+    return {"configured": True, "results": results, "warnings": warnings}
+
+
+def aggregate_summary(local_warnings, azure_warnings, custom_warnings) -> Dict[str, Any]:
+    warnings: List[str] = []
+    warnings.extend(local_warnings or [])
+    warnings.extend(azure_warnings or [])
+    warnings.extend(custom_warnings or [])
+    total_checks = 3 + 1 + 1
+    return {
+        "total": total_checks,
+        "warnings": len(warnings),
+        "healthy": max(0, total_checks - len(warnings)),
+        "warnings_list": warnings,
+    }
+
+
+# Let browsers/proxies collapse dashboard polling: short max-age plus an
+# ETag over the encoded payload so unchanged snapshots come back as 304s.
+# The encoded body is held for the same window (payloads embed timestamps,
+# so hashing a fresh build would never match If-None-Match).
+_POLL_RESPONSE_TTL_SEC = 2.0
+_POLL_CACHE_CONTROL = f"public, max-age={int(_POLL_RESPONSE_TTL_SEC)}"
+_POLL_RESPONSE_CACHE: Dict[str, Dict[str, Any]] = {}
+
+
+async def _etag_response(request: Request, key: str, build) -> Response:
+    now = time.monotonic()
+    entry = _POLL_RESPONSE_CACHE.get(key)
+    if entry is None or now - entry["ts"] >= _POLL_RESPONSE_TTL_SEC:
+        body = orjson.dumps(await build())
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        entry = {"body": body, "etag": etag, "ts": now}
+        _POLL_RESPONSE_CACHE[key] = entry
+    headers = {"ETag": entry["etag"], "Cache-Control": _POLL_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == entry["etag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+# =====================
+# API: healthcheck (REAL local health snapshot)
+# =====================
+async def _healthcheck_data() -> Dict[str, Any]:
+    local = local_health()
+    azure = await azure_health()
+    custom = await custom_endpoints_health()
+
+    summary = aggregate_summary(
+        local_warnings=local.get("warnings"),
+        azure_warnings=azure.get("warnings"),
+        custom_warnings=custom.get("warnings"),
+    )
+
+    return {
+        "ok": True,
+        "data": {
+            "timestamp": _now_iso(),
+            "summary": {
+                "total": summary["total"],
+                "healthy": summary["healthy"],
+                "warnings": summary["warnings"],
+            },
+            "warnings": summary["warnings_list"],
+            "local": local,
+            "azure": azure,
+            "custom": custom,
+        },
+    }
+
+
+@app.get("/api/healthcheck")
+async def api_healthcheck(request: Request):
+    return await _etag_response(request, "healthcheck", _healthcheck_data)
+
+
+# =====================
+# API: metrics (24h trend is synthetic, base uses live cpu/mem)
+# =====================
+_SERIES_TS_CACHE: Dict[str, Any] = {"points": 0, "value": [], "ts": 0.0}
+
+
+def _series_timestamps(points: int) -> List[str]:
+    # Hourly buckets barely move within a request burst; rebuild at most 1/s.
+    now_mono = time.monotonic()
+    if _SERIES_TS_CACHE["points"] == points and now_mono - _SERIES_TS_CACHE["ts"] < 1.0:
+        return _SERIES_TS_CACHE["value"]
+    now = datetime.now(timezone.utc)
+    stamps = [(now - timedelta(hours=h)).isoformat() for h in range(points - 1, -1, -1)]
+    _SERIES_TS_CACHE["points"] = points
+    _SERIES_TS_CACHE["value"] = stamps
+    _SERIES_TS_CACHE["ts"] = now_mono
+    return stamps
+
+
+def _series(points=24, base=50, jitter=10):
+    v = np.clip(base + (np.random.random(points) - 0.5) * jitter, 0, 100).round(2)
+    return [{"t": t, "v": float(x)} for t, x in zip(_series_timestamps(points), v)]
+
+
+async def _metrics_data() -> Dict[str, Any]:
+    base_cpu = _cpu_percent()
+    base_mem = psutil.virtual_memory().percent
+
+    return {
+        "ok": True,
+        "data": {
+            "timestamp": _now_iso(),
+            "range": "24h",
+            "syntheticTrend": True,
+            "cpu": _series(base=base_cpu, jitter=18),
+            "memory": _series(base=base_mem, jitter=14),
+            "disk": _series(base=55, jitter=10),
+            "netio": _series(base=35, jitter=22),
+        },
+    }
+
+
+@app.get("/api/metrics")
+async def api_metrics(request: Request):
+    return await _etag_response(request, "metrics", _metrics_data)
+
+
+# =====================
+# API: model listing
+# =====================
+@app.get("/api/models")
+async def api_models():
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY missing. Set it in .env")
+
+    url = f"{GEMINI_BASE}/models"
+    headers = {"x-goog-api-key": GEMINI_API_KEY}
+    r = await app.state.gemini_client.get(url, headers=headers)
+    data = r.json()
+    if r.status_code >= 400:
+        msg = (data.get("error") or {}).get("message") or "Failed to list models"
+        raise HTTPException(status_code=500, detail=msg)
+
+    models = []
+    for m in data.get("models", []):
+        name = m.get("name")
+        methods = m.get("supportedGenerationMethods") or []
+        models.append(
+            {
+                "name": name,
+                "supports_generateContent": "generateContent" in methods,
+                "supportedGenerationMethods": methods,
+            }
+        )
+    return {"ok": True, "models": models}
+
+
+# -------------------------
+# Gemini call
+# -------------------------
+async def gemini_generate(system_instruction: str, user_text: str, history=None, temperature=0.4, max_tokens=900) -> str:
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY missing. Set it in .env")
+    if not GEMINI_MODEL:
+        raise HTTPException(status_code=500, detail="GEMINI_MODEL missing. Set it in .env (use /api/models).")
+
+    history = history or []
+    payload = {
+        "contents": [*history, {"role": "user", "parts": [{"text": user_text}]}],
+        "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens},
+    }
+    if system_instruction:
+        payload["systemInstruction"] = {"role": "system", "parts": [{"text": system_instruction}]}
+
+    # Serialize with orjson ourselves rather than letting httpx use stdlib json.
+    resp = await app.state.gemini_client.post(
+        _GEMINI_GENERATE_URL, headers=_GEMINI_HEADERS, content=orjson.dumps(payload)
+    )
+    data = resp.json()
+
+    if resp.status_code >= 400:
+        msg = (data.get("error") or {}).get("message") or "Gemini API error"
+        raise HTTPException(status_code=500, detail=msg)
+
+    parts = (((data.get("candidates") or [{}])[0].get("content") or {}).get("parts") or [])
+    text = "".join([p.get("text", "") for p in parts if isinstance(p, dict)])
+    return text.strip()
+
+
+async def gemini_stream(system_instruction: str, user_text: str, history=None, temperature=0.4, max_tokens=900):
+    """
+    Yield text chunks from Gemini's streamGenerateContent SSE endpoint as
+    they arrive, instead of waiting for the full response.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY missing. Set it in .env")
+    if not GEMINI_MODEL:
+        raise HTTPException(status_code=500, detail="GEMINI_MODEL missing. Set it in .env (use /api/models).")
+
+    history = history or []
+    payload = {
+        "contents": [*history, {"role": "user", "parts": [{"text": user_text}]}],
+        "generationConfig": {"temperature": temperature, "maxOutputTokens": max_tokens},
+    }
+    if system_instruction:
+        payload["systemInstruction"] = {"role": "system", "parts": [{"text": system_instruction}]}
+
+    async with app.state.gemini_client.stream(
+        "POST", _GEMINI_STREAM_URL, headers=_GEMINI_HEADERS, content=orjson.dumps(payload)
+    ) as resp:
+        if resp.status_code >= 400:
+            body = await resp.aread()
+            msg = (_safe_json_loads(body, {}).get("error") or {}).get("message") or "Gemini API error"
+            raise HTTPException(status_code=500, detail=msg)
+
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = line[5:].strip()
+            if not chunk or chunk == "[DONE]":
+                continue
+            data = _safe_json_loads(chunk, None)
+            if not isinstance(data, dict):
+                continue
+            parts = (((data.get("candidates") or [{}])[0].get("content") or {}).get("parts") or [])
+            text = "".join(p.get("text", "") for p in parts if isinstance(p, dict))
+            if text:
+                yield text
+
+
+# =====================
+# API: report (Gemini summarization)
+# =====================
+# Last encoded JSON per prompt section, keyed by sub-dict identity. The
+# outer health/metrics wrappers are rebuilt on every call, but the inner
+# local/azure/custom snapshots are the shared TTL-cache instances, so an
+# `is` check skips re-encoding them until the snapshot rolls over.
+_REPORT_SECTION_MEMO: Dict[str, Tuple[Optional[Dict[str, Any]], str]] = {}
+
+
+def _report_section_json(key: str, obj: Optional[Dict[str, Any]]) -> str:
+    cached = _REPORT_SECTION_MEMO.get(key)
+    if cached is not None and cached[0] is obj:
+        return cached[1]
+    encoded = _dumps_pretty(obj or {})
+    _REPORT_SECTION_MEMO[key] = (obj, encoded)
+    return encoded
+
+
+def _build_report_prompt(health: Optional[Dict[str, Any]], metrics: Optional[Dict[str, Any]]) -> str:
+    h = health or {}
+    return f"""Generate today's hybrid infra health report.
+LOCAL HEALTH:
+{_report_section_json('local', h.get('local'))}
+
+AZURE HEALTH:
+{_report_section_json('azure', h.get('azure'))}
+
+CUSTOM ENDPOINTS:
+{_report_section_json('custom', h.get('custom'))}
+
+METRICS:
+{_report_section_json('metrics', metrics)}
+
+Be concise, actionable, and include a short risk score (Low/Med/High).
+"""
+
+
+@app.post("/api/report")
+async def api_report(req: ReportRequest):
+    health = req.health
+    metrics = req.metrics
+
+    if not health:
+        health_resp = await _healthcheck_data()
+        health = health_resp["data"]
+
+    if not metrics:
+        metrics = (await _metrics_data())["data"]
+
+    system_instruction = (
+        "You are InfraCopilot Lite, a virtual SRE assistant. "
+        "Summarize infra health + metrics in plain English. "
+        "Highlight risks and suggest NON-DESTRUCTIVE next actions only. "
+        "Format output as Markdown with headings, bullet points, and a short 'Next Actions' section."
+    )
+
+    user_text = _build_report_prompt(health, metrics)
+
+    md = await gemini_generate(system_instruction, user_text)
+    return {"ok": True, "reportMarkdown": md, "usedModel": GEMINI_MODEL}
+
+
+# =====================
+# Legacy supervisor endpoint (keep for compatibility)
+# =====================
+@app.post("/api/supervisor")
+async def api_supervisor(payload: SupervisorRequest):
+    # Keep minimal: treat as pure chat now
+    system_instruction = (
+        "You are InfraCopilot Lite, a ChatOps SRE assistant for Azure-like environments. "
+        "Answer clearly. If a user asks for destructive actions, suggest safe read-only alternatives."
+    )
+    text = await gemini_generate(system_instruction, payload.input or "")
+    return {"ok": True, "intent": "chat", "text": text, "usedModel": GEMINI_MODEL}
+
+
+# =====================
+# Agentic Chat: /api/chat
+# Gemini decides tool usage, backend executes, Gemini answers using tool output.
+# =====================
+# stdlib decoder kept for raw_decode (orjson has no incremental parse API)
+_JSON_DEC = json.JSONDecoder()
+_FENCE_OPEN_RE = re.compile(r"^```(?:json)?\s*", re.I)
+_FENCE_CLOSE_RE = re.compile(r"\s*```$")
+
+
+def _extract_json_object(s: str) -> Optional[dict]:
+    s = (s or "").strip()
+    if s.startswith("```"):
+        s = _FENCE_CLOSE_RE.sub("", _FENCE_OPEN_RE.sub("", s)).strip()
+    if not s:
+        return None
+    try:
+        return orjson.loads(s)
+    except Exception:
+        pass
+
+    # Not pure JSON: parse the first valid {...} with raw_decode instead of
+    # guessing a find/rfind slice, which chokes on trailing prose after the
+    # object or multiple braces in the text.
+    for i, ch in enumerate(s):
+        if ch != "{":
+            continue
+        try:
+            obj, _ = _JSON_DEC.raw_decode(s, i)
+        except ValueError:
+            continue
+        if isinstance(obj, dict):
+            return obj
+    return None
+
+
+# Rule-based routing prefilter: these mirror the planner prompt's own
+# routing rules, so obvious ChatOps phrasings skip a Gemini round trip.
+# Checked in priority order (daily_report > report > metrics > health).
+_ROUTE_RULES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("daily_report", re.compile(r"\bdaily\s+report\b", re.I)),
+    ("report", re.compile(r"\b(report|summar(?:y|ize|ise))\b", re.I)),
+    ("metrics", re.compile(r"\b(metrics?|trends?|charts?|graphs?|last\s*24\s*h(?:ours?)?)\b", re.I)),
+    ("health", re.compile(r"\b(health|status|uptime|warnings?|cpu|memory|disk)\b", re.I)),
+]
+
+
+async def _plan_action_with_gemini(user_text: str, session: Dict[str, Any], mode: str) -> Dict[str, Any]:
+    """
+    Returns: {"action": "...", "why": "...", "need_tools": bool}
+    """
+    # Mode override (from ChatOps pills)
+    mode = (mode or "auto").lower().strip()
+    if mode in ("health", "metrics", "report", "daily_report"):
+        return {"action": mode, "why": f"forced_by_mode:{mode}", "need_tools": True}
+
+    # Cheap keyword routing first; fall back to Gemini only when ambiguous
+    for action, rx in _ROUTE_RULES:
+        if rx.search(user_text):
+            return {"action": action, "why": "rule-based", "need_tools": True}
+
+    # Build a small context summary for Gemini
+    ctx = {
+        "has_last_health": bool(session.get("last_health")),
+        "has_last_metrics": bool(session.get("last_metrics")),
+        "has_last_report": bool(session.get("last_report")),
+    }
+
+    system = (
+        "You are an SRE ChatOps router. Decide the best action for the user.\n"
+        "Return ONLY a JSON object with keys:\n"
+        "  action: one of [chat, health, metrics, report, daily_report]\n"
+        "  why: short reason\n"
+        "  need_tools: true/false\n"
+        "Routing rules:\n"
+        "- If user asks to run/check health/status/uptime/warnings/local system => action=health\n"
+        "- If user asks charts/trends/last 24h/metrics => action=metrics\n"
+        "- If user asks report/summary => action=report\n"
+        "- If user asks daily report => action=daily_report\n"
+        "- If user asks follow-up like 'give details' and ctx has last_health => action=health\n"
+        "- Otherwise action=chat\n"
+        "Output must be valid JSON only."
+    )
+
+    user = f"""User message: {user_text}
+Context flags: {orjson.dumps(ctx).decode()}
+"""
+
+    plan_raw = await gemini_generate(system, user, temperature=0.0, max_tokens=220)
+    plan = _extract_json_object(plan_raw) or {}
+
+    action = (plan.get("action") or "chat").strip().lower()
+    if action not in ("chat", "health", "metrics", "report", "daily_report"):
+        action = "chat"
+
+    need_tools = bool(plan.get("need_tools")) if "need_tools" in plan else (action != "chat")
+    why = (plan.get("why") or "n/a").strip()
+
+    return {"action": action, "why": why, "need_tools": need_tools}
+
+
+LLM_SERIES_POINTS = int(os.getenv("LLM_SERIES_POINTS", "8"))
+LLM_REPORT_MAX_CHARS = int(os.getenv("LLM_REPORT_MAX_CHARS", "4000"))
+
+
+def _compact_for_llm(value: Any) -> Any:
+    """
+    Trim tool outputs before prompt encoding: drop empty/synthetic fields,
+    downsample time series, cap report length. Fewer bytes encoded, sent,
+    and billed as Gemini input tokens.
+    """
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if k == "syntheticTrend" or v is None or v == [] or v == {}:
+                continue
+            if k == "reportMarkdown" and isinstance(v, str) and len(v) > LLM_REPORT_MAX_CHARS:
+                v = v[:LLM_REPORT_MAX_CHARS] + "\n...(truncated)"
+            out[k] = _compact_for_llm(v)
+        return out
+    if isinstance(value, list):
+        if len(value) > LLM_SERIES_POINTS and all(
+            isinstance(p, dict) and set(p) == {"t", "v"} for p in value[:3]
+        ):
+            stride = max(1, len(value) // LLM_SERIES_POINTS)
+            value = value[::stride][:LLM_SERIES_POINTS]
+        return [_compact_for_llm(v) for v in value]
+    return value
+
+
+async def _answer_with_tools(user_text: str, action: str, session: Dict[str, Any], tool_payload: Dict[str, Any]) -> str:
+    """
+    Gemini final response using tool outputs.
+    """
+    system = (
+        "You are InfraCopilot Lite, an SRE assistant.\n"
+        "Use TOOL_OUTPUTS to answer the user's question.\n"
+        "Be concise but helpful. Include:\n"
+        "- what you observed\n"
+        "- key values (cpu/mem/disk/uptime for health)\n"
+        "- warnings if any\n"
+        "- non-destructive next steps\n"
+        "Format with short headings and bullets.\n"
+        "Do NOT ask unnecessary clarification if TOOL_OUTPUTS already contains the needed info."
+    )
+
+    user = f"""USER_QUESTION:
+{user_text}
+
+ACTION:
+{action}
+
+TOOL_OUTPUTS (JSON):
+{orjson.dumps(_compact_for_llm(tool_payload)).decode()[:12000]}
+"""
+
+    return await gemini_generate(system, user, temperature=0.35, max_tokens=900)
+
+
+async def _discard_tasks(*tasks: "asyncio.Task") -> None:
+    """Cancel and await tasks so abandoned speculative work can't leak
+    'task was destroyed' warnings or unobserved exceptions."""
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+
+CHAT_HISTORY_BUDGET_CHARS = int(os.getenv("CHAT_HISTORY_BUDGET_CHARS", "12000"))
+
+
+def _trim_history(history: List[Dict[str, Any]], max_turns: int) -> List[Dict[str, Any]]:
+    """
+    Bound history by total text size, not just turn count: one verbose
+    report in the history would otherwise inflate every following Gemini
+    payload. max_turns stays as a secondary cap on message count.
+    """
+    if len(history) > max_turns * 2:  # user+bot pairs
+        history = history[-max_turns * 2 :]
+
+    # Walk newest to oldest, committing whole user-led pairs: a cut is only
+    # taken where a user turn starts, so trimmed history never opens with a
+    # model turn. The newest pair always survives, even when oversized.
+    total = 0
+    keep = 0
+    candidate = 0
+    for msg in reversed(history):
+        total += sum(len(p.get("text", "")) for p in msg.get("parts", []))
+        candidate += 1
+        if msg.get("role") != "model":
+            if keep and total > CHAT_HISTORY_BUDGET_CHARS:
+                break
+            keep = candidate
+    return history[len(history) - keep :]
+
+
+async def _stream_chat_answer(system: str, user_text: str, history: List[Dict[str, Any]], session: Dict[str, Any], max_turns: int):
+    """
+    SSE generator for streamed chat answers. Accumulates the full text
+    server-side so the session history stays consistent with the JSON path.
+    """
+    chunks: List[str] = []
+    try:
+        try:
+            async for piece in gemini_stream(system, user_text, history=history, temperature=0.45, max_tokens=900):
+                chunks.append(piece)
+                yield f"data: {orjson.dumps({'text': piece}).decode()}\n\n"
+        except HTTPException as e:
+            # The 200 response start is already on the wire, so raising here
+            # would just abort the connection; surface the upstream error as
+            # a terminal SSE event instead.
+            yield f"data: {orjson.dumps({'error': str(e.detail)}).decode()}\n\n"
+        except Exception as e:
+            logger.exception("Gemini stream failed")
+            yield f"data: {orjson.dumps({'error': f'Gemini stream failed: {e}'}).decode()}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        final_text = "".join(chunks)
+        if final_text:
+            history.append({"role": "model", "parts": [{"text": final_text}]})
+            session["history"] = _trim_history(history, max_turns)
+
+
+@app.post("/api/chat")
+async def api_chat(req: ChatRequest):
+    session_id = req.sessionId or str(uuid.uuid4())
+    session = _get_session(session_id)
+
+    user_text = (req.input or "").strip()
+    if not user_text:
+        return {"ok": True, "sessionId": session_id, "toolUsed": "none", "text": "Say something and I’ll help."}
+
+    # Keep simple conversation history for better follow-ups
+    history = session.get("history") or []
+
+# ---- Append current user message to session history (Gemini format) ----
+    history.append({"role": "user", "parts": [{"text": user_text}]})
+
+    max_turns = int(os.getenv("CHAT_HISTORY_TURNS", "10"))
+
+    # Trim on the append path too: when the planner or Gemini call below
+    # raises, this request exits before the post-reply trim, and retries on
+    # the same session would otherwise grow the stored history without
+    # bound. The walk is over at most max_turns*2 messages, so it's cheap.
+    history = _trim_history(history, max_turns)
+    session["history"] = history
+
+    # ---- Plan + speculative tools ----
+    # Start health/metrics collection while the planner round-trips to
+    # Gemini; by the time the plan lands, the tool results are usually
+    # already in. Unused results are cheap thanks to the TTL caches.
+    plan_task = asyncio.create_task(_plan_action_with_gemini(user_text, session, req.mode))
+    health_task = asyncio.create_task(_healthcheck_data())
+    metrics_task = asyncio.create_task(_metrics_data())
+
+    try:
+        plan = await plan_task
+    except Exception:
+        await _discard_tasks(health_task, metrics_task)
+        raise
+
+    action = plan.get("action", "chat")
+    why = plan.get("why", "")
+    need_tools = bool(plan.get("need_tools", action != "chat"))
+
+    tool_payload: Dict[str, Any] = {"action": action, "why": why}
+    tool_used = action
+
+    # ---- Execute tools if needed ----
+    health_obj = None
+    metrics_obj = None
+    report_md = None
+
+    try:
+        if need_tools and action in ("health", "daily_report", "report"):
+            hc = await health_task
+            health_obj = hc["data"]
+            session["last_health"] = health_obj
+            tool_payload["health"] = health_obj
+
+        if need_tools and action in ("metrics", "daily_report", "report"):
+            mc = await metrics_task
+            metrics_obj = mc["data"]
+            session["last_metrics"] = metrics_obj
+            tool_payload["metrics"] = metrics_obj
+
+        if need_tools and action in ("report", "daily_report"):
+            # Use tool outputs if already fetched, else pull from session
+            h = health_obj or session.get("last_health")
+            m = metrics_obj or session.get("last_metrics")
+
+            rep = await api_report(ReportRequest(health=h, metrics=m))
+            report_md = rep.get("reportMarkdown", "")
+            session["last_report"] = report_md
+            tool_payload["reportMarkdown"] = report_md
+
+    except HTTPException:
+        # bubble up FastAPI errors (e.g., missing GEMINI key/model)
+        raise
+    except Exception as e:
+        logger.exception("Tool execution failed")
+        raise HTTPException(status_code=500, detail=f"Tool execution failed: {e}")
+    finally:
+        # Cancel whatever the plan didn't consume (no-op for awaited tasks).
+        await _discard_tasks(health_task, metrics_task)
+
+    # ---- Final answer: Gemini composes response using tool outputs (agentic) ----
+    try:
+        if action == "chat":
+            system = (
+                "You are InfraCopilot Lite, a helpful SRE assistant.\n"
+                "Answer clearly and practically.\n"
+                "If the user asks for destructive actions, suggest safe read-only alternatives.\n"
+                "Use brief headings and bullet points when helpful."
+            )
+            if req.stream:
+                # Stream tokens as they decode; first text reaches the UI at
+                # first-chunk latency instead of full-response latency.
+                return StreamingResponse(
+                    _stream_chat_answer(system, user_text, history, session, max_turns),
+                    media_type="text/event-stream",
+                    headers={"X-Session-Id": session_id},
+                )
+            final_text = await gemini_generate(system, user_text, history=history, temperature=0.45, max_tokens=900)
+        else:
+            # If user asks follow-up like “details”, use last tool outputs even if tool didn't run
+            if action == "health" and not health_obj:
+                health_obj = session.get("last_health")
+                if health_obj:
+                    tool_payload["health"] = health_obj
+
+            if action == "metrics" and not metrics_obj:
+                metrics_obj = session.get("last_metrics")
+                if metrics_obj:
+                    tool_payload["metrics"] = metrics_obj
+
+            if action in ("report", "daily_report") and not report_md:
+                report_md = session.get("last_report")
+                if report_md:
+                    tool_payload["reportMarkdown"] = report_md
+
+            final_text = await _answer_with_tools(user_text, action, session, tool_payload)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Gemini answer generation failed")
+        raise HTTPException(status_code=500, detail=f"Gemini answer generation failed: {e}")
+
+    # ---- Add assistant message into history ----
+    history.append({"role": "model", "parts": [{"text": final_text}]})
+    history = _trim_history(history, max_turns)
+    session["history"] = history
+
+    # ---- Build response expected by updated app.js ----
+    resp: Dict[str, Any] = {
+        "ok": True,
+        "sessionId": session_id,
+        "toolUsed": tool_used,
+        "text": final_text,
+        "usedModel": GEMINI_MODEL,
+    }
+
+    # Attach tool results so UI can update dashboard (KPIs/charts/report)
+    if health_obj:
+        resp["health"] = health_obj
+    if metrics_obj:
+        resp["metrics"] = metrics_obj
+    if report_md is not None:
+        resp["reportMarkdown"] = report_md
+
+    return resp
+
+
+# =====================
+# Entrypoint (python -m app.main)
+# =====================
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        # Default to a single worker: _SESSIONS and the TTL/token caches are
+        # per-process, so raising WEB_CONCURRENCY needs sticky routing (or an
+        # external session store) to keep /api/chat follow-ups coherent.
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        # Keep client connections open between dashboard polls / chat turns
+        timeout_keep_alive=int(os.getenv("KEEPALIVE", "30")),
+        # "auto" picks httptools/uvloop where installed (uvicorn[standard]),
+        # falling back cleanly on platforms without them (e.g. Windows)
+        http="auto",
+        loop="auto",
+    )
\ No newline at end of file